@@ -1,10 +1,24 @@
 import os
+import re
+import gzip
+import atexit
+import asyncio
+import hashlib
+import random
 import logging
+import threading
 import traceback
+from collections import OrderedDict
 
-from flask import Flask, request, jsonify
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from quart import Quart, Response, request # Flask's API on asyncio, so LLM calls can be awaited concurrently
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.json import parse_json_markdown
 from pydantic import BaseModel, Field # Pydantic v2 is now used internally by LangChain 0.3.0+
 from dotenv import load_dotenv
 
@@ -12,16 +26,83 @@ from dotenv import load_dotenv
 # Ensure you have 'langchain-openai' installed (pip install langchain-openai)
 from langchain_openai import ChatOpenAI
 
-# --- Configure logging to capture more details ---
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
+# --- Optional: semantic feedback cache (pip install sentence-transformers faiss-cpu) ---
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    faiss = None
 
-# --- Load your secret API key from the .env file ---
+# --- Optional: Brotli response compression (pip install brotli); gzip is used otherwise ---
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- Load your secret API key from the .env file (before logging, so LOG_LEVEL can come from it) ---
 load_dotenv()
+# Tracebacks go to the log; only echo them in error responses when DEBUG_ERRORS=1 (read after .env is loaded)
+DEBUG_ERRORS = os.getenv("DEBUG_ERRORS", "0") == "1"
+
+# --- Configure logging (set LOG_LEVEL=DEBUG in .env to capture more details) ---
+requested_log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+# getLevelName returns a string like "Level VERBOSE" for unknown names; fall back to INFO instead of crashing
+log_level = requested_log_level if isinstance(logging.getLevelName(requested_log_level), int) else "INFO"
+logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
 logging.debug(".env file loaded.")
+if log_level != requested_log_level:
+    logging.warning("Unknown LOG_LEVEL %r; using INFO.", requested_log_level)
 
-app = Flask(__name__) # This sets up the web connection part
+# --- Read the GMAT style guide once at startup instead of on every request ---
+try:
+    with open('gmat_style_guide.txt', 'r') as f:
+        GMAT_STYLE_GUIDE = f.read()
+    GMAT_STYLE_GUIDE_SHA = hashlib.sha256(GMAT_STYLE_GUIDE.encode()).hexdigest()
+    logging.debug("Successfully read gmat_style_guide.txt (length: %d chars)", len(GMAT_STYLE_GUIDE))
+except FileNotFoundError:
+    GMAT_STYLE_GUIDE = None
+    GMAT_STYLE_GUIDE_SHA = None
+    logging.error("gmat_style_guide.txt not found. /generate_question will fail until it's in the same folder.")
+
+app = Quart(__name__) # This sets up the web connection part
+
+
+def ojson(obj, status=200):
+    # orjson serializes much faster than jsonify (stdlib json) and returns bytes directly
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+# --- Compress JSON responses: long explanations shrink to a fraction of their size on the way to Make.com ---
+# (Flask-Compress doesn't support Quart, so this is a small after_request hook with the same settings.)
+COMPRESS_MIMETYPES = {'application/json'}
+COMPRESS_LEVEL = 4
+COMPRESS_MIN_SIZE = 500
+
+@app.after_request
+async def compress_response(response):
+    # SSE streams are text/event-stream, so they are never buffered here
+    if response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if brotli is not None and request.accept_encodings.quality('br') > 0:
+        encoding = 'br'
+    elif request.accept_encodings.quality('gzip') > 0:
+        encoding = 'gzip'
+    else:
+        return response
+
+    data = await response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=COMPRESS_LEVEL))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 # --- Updated LLM Initialization for OpenRouter (DeepSeek) ---
 # Initialize the LLM outside the route functions to avoid re-initializing on each request
@@ -31,24 +112,38 @@ try:
     openrouter_model_name = os.getenv("OPENROUTER_MODEL_NAME", "deepseek/deepseek-r1-0528-qwen3-8b:free")
 
     if openrouter_api_key:
-        logging.debug(f"OPENROUTER_API_KEY loaded successfully. Starts with: {openrouter_api_key[:5]}...")
+        logging.debug("OPENROUTER_API_KEY loaded successfully. Starts with: %s...", openrouter_api_key[:5])
+        # Shared keep-alive pools so requests reuse TCP+TLS connections to openrouter.ai
+        # instead of handshaking per call (http2 needs: pip install "httpx[http2]")
+        http_limits = httpx.Limits(max_connections=200, max_keepalive_connections=100)
+        shared_http = httpx.AsyncClient(limits=http_limits, http2=True, timeout=60)
+        shared_sync_http = httpx.Client(limits=http_limits, http2=True, timeout=60)
         # ChatOpenAI is used because OpenRouter provides an OpenAI-compatible API
         llm = ChatOpenAI(
             model=openrouter_model_name,
             openai_api_key=openrouter_api_key,
-            base_url="https://openrouter.ai/api/v1" # This is OpenRouter's API endpoint
+            base_url="https://openrouter.ai/api/v1", # This is OpenRouter's API endpoint
+            http_async_client=shared_http,
+            http_client=shared_sync_http,
+            max_retries=0 # 429s, 5xx and connection errors are retried by _call_llm, with its backoff outside LLM_SEM
         )
-        logging.debug(f"LLM initialized: {openrouter_model_name} via OpenRouter.")
+        logging.debug("LLM initialized: %s via OpenRouter.", openrouter_model_name)
     else:
         logging.error("OPENROUTER_API_KEY is NOT loaded. Check .env file and environment.")
         raise ValueError("OPENROUTER_API_KEY not found in environment. Please check .env file.")
 
 except Exception as e:
-    logging.critical(f"CRITICAL ERROR: Failed to initialize LLM model: {e}")
-    traceback.print_exc()
+    logging.critical("CRITICAL ERROR: Failed to initialize LLM model: %s", e, exc_info=True)
     exit(1)
 
 
+@app.after_serving
+async def close_http_clients():
+    # Close the pooled connections on the same event loop that opened them
+    await shared_http.aclose()
+    shared_sync_http.close()
+
+
 # --- These are like "blueprints" for the AI's answers ---
 class QuestionOutput(BaseModel):
     question: str = Field(description="The GMAT-style math question text.")
@@ -62,169 +157,619 @@ class FeedbackOutput(BaseModel):
     remediation_topic: str = Field(description="A specific topic for the student to review if incorrect (e.g., 'Algebra: Linear Equations').")
 
 
+# --- Concurrency control in front of OpenRouter ---
+# A burst of requests would otherwise open hundreds of simultaneous calls and trip OpenRouter's
+# rate limit; cap in-flight calls per process and smooth them to a steady QPS.
+LLM_SEM = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "32")))
+LLM_QPS = AsyncLimiter(int(os.getenv("LLM_QPS", "20")), 1)
+LLM_RATE_LIMIT_RETRIES = 4
+# The SDK's own retries are off (max_retries=0), so everything it used to retry is retried here:
+# 429s, 5xx responses, and connection errors (APITimeoutError is a subclass of APIConnectionError)
+LLM_RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+def _retry_delay(attempt, error):
+    # Exponential backoff with jitter
+    delay = min(2 ** attempt, 30) * random.uniform(0.5, 1.5)
+    logging.warning("OpenRouter call failed (%s); retrying in %.1fs", type(error).__name__, delay)
+    return delay
+
+async def _call_llm(messages):
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        try:
+            async with LLM_SEM, LLM_QPS:
+                return await llm.ainvoke(messages)
+        except LLM_RETRYABLE_ERRORS as e:
+            if attempt == LLM_RATE_LIMIT_RETRIES:
+                raise
+            # Sleep outside the semaphore so other calls can proceed
+            await asyncio.sleep(_retry_delay(attempt, e))
+
+# Used in place of llm in every chain, so ainvoke/abatch all go through the limits above
+limited_llm = RunnableLambda(_call_llm)
+
+
+# --- Prompts and chains are built once here and only invoked per request ---
+# Static text (persona, style guide, rules) comes first and per-request values come last,
+# so every call shares the same prompt prefix and OpenRouter/DeepSeek prompt caching can kick in.
+# The Pydantic models only supply JSON schemas, serialized once here and embedded in the
+# system prompts; responses are parsed straight to dicts by parse_json_output below.
+QUESTION_SCHEMA_STR = orjson.dumps(QuestionOutput.model_json_schema()).decode()
+FEEDBACK_SCHEMA_STR = orjson.dumps(FeedbackOutput.model_json_schema()).decode()
+
+_CODE_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+
+def _parse_json_output(message):
+    # Models often wrap JSON in ```json fences; take what's inside if so
+    text = message.content
+    match = _CODE_FENCE_RE.search(text)
+    if match:
+        text = match.group(1)
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # orjson is strict; LLMs often put raw newlines inside multi-line strings or leave JSON
+        # slightly malformed, which LangChain's lenient parser (strict=False + partial repair) accepts
+        return parse_json_markdown(message.content)
+
+parse_json_output = RunnableLambda(_parse_json_output)
+
+# This is the "brain's instructions" for generating a question
+QUESTION_SYSTEM_PROMPT = """You are an expert GMAT quantitative question designer.
+     {gmat_style_guide}
+     Generate a GMAT-style Multiple Choice question with 5 options (A, B, C, D, E).
+     Focus on concise, clear language typical of GMAT.
+     Ensure the question has one clear correct answer.
+     For 'Hard' difficulty, include a subtle trap or require multiple steps.
+     Your output MUST be a JSON object conforming to the QuestionOutput schema.
+     Respond with JSON matching this schema: {question_schema}
+     """
+
+question_prompt = ChatPromptTemplate.from_messages([
+    ("system", QUESTION_SYSTEM_PROMPT),
+    ("human", """Generate a GMAT Quant question with 5 options (A, B, C, D, E).
+     Difficulty: {difficulty}
+     Topic: {topic}
+     """)
+]).partial(gmat_style_guide=GMAT_STYLE_GUIDE or "", question_schema=QUESTION_SCHEMA_STR) # Bake the guide in so the system message is a constant
+QUESTION_CHAIN = question_prompt | limited_llm | parse_json_output
+
+# Same system message, so batched calls share the cached prefix too
+question_batch_prompt = ChatPromptTemplate.from_messages([
+    ("system", QUESTION_SYSTEM_PROMPT),
+    ("human", """Generate {count} distinct GMAT Quant questions, each with 5 options (A, B, C, D, E).
+     Return a JSON array of {count} objects, each conforming to the QuestionOutput schema.
+     Difficulty: {difficulty}
+     Topic: {topic}
+     """)
+]).partial(gmat_style_guide=GMAT_STYLE_GUIDE or "", question_schema=QUESTION_SCHEMA_STR)
+QUESTION_BATCH_CHAIN = question_batch_prompt | limited_llm | parse_json_output
+
+# For /generate_question/stream: the raw llm streams tokens, and JsonOutputParser turns the
+# growing JSON text into progressively more complete dicts (each one a valid partial object)
+QUESTION_STREAM_CHAIN = question_prompt | llm | JsonOutputParser()
+
+feedback_prompt = ChatPromptTemplate.from_messages([
+    ("system", """You are a supportive and insightful GMAT tutor.
+     Provide personalized feedback to the student based on their answer.
+     If correct, offer positive reinforcement and explain why it's right.
+     If incorrect, first clearly state the correct answer. Then, explain why the student's answer is wrong, why the correct answer is right (referencing the detailed explanation provided). Suggest a specific remediation topic (e.g., 'Algebra: Word Problems', 'Geometry: Triangles') if incorrect.
+     Keep feedback concise and encouraging.
+     Your output MUST be a JSON object conforming to the FeedbackOutput schema.
+     Respond with JSON matching this schema: {feedback_schema}
+     """),
+    ("human", """Student's question: {question_text}
+     Detailed explanation: {explanation}
+     Correct answer: {correct_answer}
+     Student's answer: {student_answer}
+     Is correct: {is_correct}
+     """)
+]).partial(feedback_schema=FEEDBACK_SCHEMA_STR)
+FEEDBACK_CHAIN = feedback_prompt | limited_llm | parse_json_output
+
+test_prompt_template = ChatPromptTemplate.from_messages([
+    ("human", "{user_prompt}")
+])
+TEST_CHAIN = test_prompt_template | limited_llm
+
+
+# --- Semantic cache for feedback: near-duplicate submissions reuse an earlier LLM answer ---
+class SemanticFeedbackCache:
+    def __init__(self, model_name, path, threshold=0.92):
+        self.model = SentenceTransformer(model_name)
+        self.threshold = threshold
+        self.index_path = f"{path}.faiss"
+        self.entries_path = f"{path}.json"
+        self.lock = threading.Lock()
+        self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+        self.entries = [] # Parallel to the index: {"student_answer", "correct_answer", "is_correct", "feedback"}
+        if os.path.exists(self.index_path) and os.path.exists(self.entries_path):
+            self._load()
+
+    def _load(self):
+        try:
+            index = faiss.read_index(self.index_path)
+            with open(self.entries_path, 'rb') as f:
+                entries = orjson.loads(f.read())
+        except Exception as e:
+            logging.warning("Could not load the semantic feedback cache; starting empty: %s", e)
+            return
+        # Each worker process saves on exit, so the two files can come from different processes
+        if index.ntotal != len(entries) or index.d != self.index.d:
+            logging.warning("Semantic feedback cache files are out of sync (%d vectors, %d entries); starting empty.",
+                            index.ntotal, len(entries))
+            return
+        self.index = index
+        self.entries = entries
+
+    def embed(self, text):
+        # Normalized vectors make the inner product of IndexFlatIP a cosine similarity
+        return self.model.encode([text], normalize_embeddings=True).astype('float32')
+
+    def lookup(self, vec, student_answer, correct_answer, is_correct):
+        with self.lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vec, min(5, self.index.ntotal))
+            for score, idx in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                entry = self.entries[idx]
+                # The question text dominates the embedding, so a different answer to the same question,
+                # or a near-identical question with a different key (shuffled options, changed numbers),
+                # can still score above the threshold; only reuse feedback when both answers match.
+                if (entry["student_answer"] == student_answer and entry.get("correct_answer") == correct_answer
+                        and entry["is_correct"] == is_correct):
+                    return entry["feedback"]
+        return None
+
+    def add(self, vec, student_answer, correct_answer, is_correct, feedback):
+        with self.lock:
+            self.index.add(vec)
+            self.entries.append({"student_answer": student_answer, "correct_answer": correct_answer,
+                                 "is_correct": is_correct, "feedback": feedback})
+
+    def save(self):
+        # Write to per-process temp files and os.replace them, so a reader (or another worker
+        # saving at the same time) never sees a half-written file
+        suffix = f".tmp{os.getpid()}"
+        with self.lock:
+            faiss.write_index(self.index, self.index_path + suffix)
+            with open(self.entries_path + suffix, 'wb') as f:
+                f.write(orjson.dumps(self.entries))
+        os.replace(self.index_path + suffix, self.index_path)
+        os.replace(self.entries_path + suffix, self.entries_path)
+
+
+feedback_cache = None
+if faiss is not None:
+    try:
+        feedback_cache = SemanticFeedbackCache(
+            os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+            os.getenv("SEMANTIC_CACHE_PATH", "feedback_cache"),
+        )
+    except Exception as e:
+        # The cache is optional; e.g. an offline host or a bad SEMANTIC_CACHE_MODEL shouldn't stop the app
+        logging.warning("Could not initialize the semantic feedback cache; continuing without it: %s", e)
+    else:
+        atexit.register(feedback_cache.save)
+        logging.debug("Semantic feedback cache enabled (%d cached entries).", feedback_cache.index.ntotal)
+else:
+    logging.debug("sentence-transformers/faiss not installed; semantic feedback cache disabled.")
+
+# --- Question batching: requests for the same (topic, difficulty) that arrive together share one LLM call ---
+_QUESTION_KEYS = tuple(QuestionOutput.model_fields)
+
+def _is_question(obj):
+    # Only a dict with every QuestionOutput field counts as a question (checked before batching or caching)
+    return isinstance(obj, dict) and all(k in obj for k in _QUESTION_KEYS)
+
+class RequestBatcher:
+    def __init__(self, batch_interval=0.05, max_batch_size=8):
+        self.batch_interval = batch_interval
+        self.max_batch_size = max_batch_size
+        self.pending_requests = {} # (topic, difficulty) -> list of futures waiting for a question
+        self._tasks = set() # Strong references so running batches aren't garbage-collected
+
+    async def submit(self, topic, difficulty):
+        key = (topic, difficulty)
+        future = asyncio.get_running_loop().create_future()
+        waiters = self.pending_requests.setdefault(key, [])
+        waiters.append(future)
+        if len(waiters) == 1:
+            self._spawn(self._flush_after_interval(key, waiters))
+        elif len(waiters) >= self.max_batch_size:
+            del self.pending_requests[key]
+            self._spawn(self._run_batch(key, waiters))
+        return await future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_after_interval(self, key, waiters):
+        await asyncio.sleep(self.batch_interval)
+        # The batch may already have been sent early because it filled up
+        if self.pending_requests.get(key) is waiters:
+            del self.pending_requests[key]
+            await self._run_batch(key, waiters)
+
+    async def _run_batch(self, key, waiters):
+        topic, difficulty = key
+        inputs = {"topic": topic, "difficulty": difficulty}
+        try:
+            if len(waiters) == 1:
+                questions = [await QUESTION_CHAIN.ainvoke(inputs)]
+            else:
+                logging.debug("Generating %d '%s' questions on '%s' in one LLM call.", len(waiters), difficulty, topic)
+                questions = await QUESTION_BATCH_CHAIN.ainvoke({**inputs, "count": len(waiters)})
+                # The system prompt asks for a JSON object, so the model may wrap the array as {"questions": [...]}
+                if isinstance(questions, dict) and len(questions) == 1:
+                    (wrapped,) = questions.values()
+                    if isinstance(wrapped, list):
+                        questions = wrapped
+                if not isinstance(questions, list):
+                    questions = [questions]
+                questions = [q for q in questions if _is_question(q)][:len(waiters)]
+                # Top up individually if the model returned fewer usable questions than asked for
+                missing = len(waiters) - len(questions)
+                if missing > 0:
+                    questions += await asyncio.gather(*(QUESTION_CHAIN.ainvoke(inputs) for _ in range(missing)))
+        except Exception as e:
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, question in zip(waiters, questions):
+            if not future.done(): # The client may have disconnected
+                future.set_result(question)
+
+
+QUESTION_BATCHER = RequestBatcher(batch_interval=0.05, max_batch_size=8)
+
+# --- Question cache: the inputs come from a tiny (topic x difficulty) space, so repeats skip the LLM ---
+# Set QUESTION_CACHE_SIZE=0 to always ask the LLM for a fresh question.
+# (functools.lru_cache can't wrap a coroutine, so this is a small OrderedDict LRU instead.)
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "512"))
+_question_cache = OrderedDict()
+
+async def _cached_question(topic, difficulty, guide_sha256):
+    # guide_sha256 is part of the key so a changed gmat_style_guide.txt (after a restart) never reuses old entries
+    key = (topic, difficulty, guide_sha256)
+    if key in _question_cache:
+        _question_cache.move_to_end(key)
+        return _question_cache[key]
+
+    logging.debug("Attempting to invoke LLM chain for question generation...")
+    response = await QUESTION_BATCHER.submit(topic, difficulty)
+    # Never cache a malformed reply, or every later request for this key would get it too
+    if QUESTION_CACHE_SIZE > 0 and _is_question(response):
+        _question_cache[key] = response
+        if len(_question_cache) > QUESTION_CACHE_SIZE:
+            _question_cache.popitem(last=False)
+    return response
+
+
 # --- 1. Question Generation Code (When Make.com asks for a question) ---
 @app.route('/generate_question', methods=['POST'])
-def generate_question():
-    data = request.json
-    topic = data.get('topic', 'Algebra')
-    difficulty = data.get('difficulty', 'Medium')
-
-    logging.debug(f"Received request for topic='{topic}', difficulty='{difficulty}'")
+async def generate_question():
     try:
-        with open('gmat_style_guide.txt', 'r') as f:
-            gmat_style_guide = f.read()
-        logging.debug(f"Successfully read gmat_style_guide.txt (length: {len(gmat_style_guide)} chars)")
-    except FileNotFoundError:
+        data = orjson.loads(await request.get_data(cache=False))
+    except orjson.JSONDecodeError as e:
+        logging.error("Could not parse JSON body for /generate_question: %s", e)
+        return ojson({"error": "Could not parse JSON body. Ensure the body is valid JSON."}, 400)
+    if not isinstance(data, dict):
+        logging.error("JSON body for /generate_question is not an object.")
+        return ojson({"error": "Request body must be a JSON object."}, 400)
+    # Normalize so "Algebra " and "algebra" share one cache entry
+    topic = str(data.get('topic', 'Algebra')).strip().lower()
+    difficulty = str(data.get('difficulty', 'Medium')).strip().lower()
+
+    logging.debug("Received request for topic='%s', difficulty='%s'", topic, difficulty)
+    if GMAT_STYLE_GUIDE is None:
         logging.error("gmat_style_guide.txt not found. Make sure it's in the same folder.")
-        return jsonify({"error": "gmat_style_guide.txt not found. Make sure it's in the same folder."}), 500
-
-    # This is the "brain's instructions" for generating a question
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", f"""You are an expert GMAT quantitative question designer.
-         {gmat_style_guide}
-         Generate a GMAT-style Multiple Choice question with 5 options (A, B, C, D, E).
-         Focus on concise, clear language typical of GMAT.
-         Ensure the question has one clear correct answer.
-         For 'Hard' difficulty, include a subtle trap or require multiple steps.
-         Your output MUST be a JSON object conforming to the QuestionOutput schema.
-         """),
-        ("human", f"Generate a {difficulty} difficulty GMAT Quant question on the topic of {topic}. Provide 5 options (A, B, C, D, E).")
-    ])
+        return ojson({"error": "gmat_style_guide.txt not found. Make sure it's in the same folder."}, 500)
 
     try:
-        logging.debug("Attempting to invoke LLM chain for question generation...")
-        chain = prompt | llm | JsonOutputParser(pydantic_object=QuestionOutput)
-        response = chain.invoke({"topic": topic, "difficulty": difficulty}) # Pass relevant data to invoke
-        logging.debug(f"LLM chain invoked successfully. Response data: {response}") # Added to log the actual response
-        return jsonify(response)
+        response = await _cached_question(topic, difficulty, GMAT_STYLE_GUIDE_SHA)
+        logging.debug("LLM chain for question generation invoked successfully.")
+        return ojson(response)
     except Exception as e:
-        logging.error(f"ERROR during question generation: {e}")
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        logging.exception("ERROR during question generation: %s", e)
+        return ojson({"error": str(e)}, 500)
+
+
+# --- 1b. Streaming Question Generation (Server-Sent Events, so clients can start reading early) ---
+@app.route('/generate_question/stream', methods=['POST'])
+async def generate_question_stream():
+    try:
+        data = orjson.loads(await request.get_data(cache=False))
+    except orjson.JSONDecodeError as e:
+        logging.error("Could not parse JSON body for /generate_question/stream: %s", e)
+        return ojson({"error": "Could not parse JSON body. Ensure the body is valid JSON."}, 400)
+    if not isinstance(data, dict):
+        logging.error("JSON body for /generate_question/stream is not an object.")
+        return ojson({"error": "Request body must be a JSON object."}, 400)
+    topic = str(data.get('topic', 'Algebra')).strip().lower()
+    difficulty = str(data.get('difficulty', 'Medium')).strip().lower()
+
+    logging.debug("Received streaming request for topic='%s', difficulty='%s'", topic, difficulty)
+    if GMAT_STYLE_GUIDE is None:
+        logging.error("gmat_style_guide.txt not found. Make sure it's in the same folder.")
+        return ojson({"error": "gmat_style_guide.txt not found. Make sure it's in the same folder."}, 500)
+
+    async def events():
+        question = None
+        try:
+            for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+                try:
+                    # limited_llm can't stream, so take the same concurrency/QPS slots around the stream
+                    async with LLM_SEM, LLM_QPS:
+                        async for question in QUESTION_STREAM_CHAIN.astream({"topic": topic, "difficulty": difficulty}):
+                            yield b"data: " + orjson.dumps(question) + b"\n\n"
+                    break
+                except LLM_RETRYABLE_ERRORS as e:
+                    # Once partial output has been sent the stream can't be restarted cleanly
+                    if question is not None or attempt == LLM_RATE_LIMIT_RETRIES:
+                        raise
+                    await asyncio.sleep(_retry_delay(attempt, e))
+            yield b"event: done\ndata: " + orjson.dumps(question) + b"\n\n"
+        except Exception as e:
+            logging.exception("ERROR during streaming question generation: %s", e)
+            yield b"event: error\ndata: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+
+    response = Response(events(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+    # Quart's RESPONSE_TIMEOUT (60s) covers the whole body and would cut off a long reasoning-model
+    # generation mid-stream, with no done/error event; the LLM calls inside have their own timeouts
+    response.timeout = None
+    return response
+
+
+# --- Answer checking: map option letters to ints instead of comparing lowercased copies ---
+_ANS_MAP = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4}
+
+_OPTION_SEPARATORS = (')', '.', ':')
+
+def _answer_index(answer):
+    # "B", "b", "B) 12", "B. 12" and "B: 12" all map to 1; anything else
+    # (a numeric answer, or an expression like "a+b" or "e^2") is -1
+    if not isinstance(answer, str):
+        return -1
+    answer = answer.strip()
+    if len(answer) > 1 and answer[1] not in _OPTION_SEPARATORS:
+        return -1
+    return _ANS_MAP.get(answer[:1].lower(), -1)
+
+def _check_answer(student_answer, correct_answer):
+    student_idx = _answer_index(student_answer)
+    correct_idx = _answer_index(correct_answer)
+    if student_idx >= 0 and correct_idx >= 0:
+        return student_idx == correct_idx
+    # Fall back to a string compare for numeric or free-form answers
+    return str(student_answer).strip().lower() == str(correct_answer).strip().lower()
+
+def _answer_key(answer):
+    # Option letters as their index ("B" and "B) 12" are both 1), anything else lowercased
+    idx = _answer_index(answer)
+    return idx if idx >= 0 else str(answer).strip().lower()
+
+# With FAST_CORRECT_FEEDBACK=1, correct answers get templated feedback built from the
+# explanation instead of an LLM call (the tutor's reply there is mostly boilerplate)
+FAST_CORRECT_FEEDBACK = os.getenv("FAST_CORRECT_FEEDBACK", "0") == "1"
+
+
+# --- Feedback helpers shared by /evaluate_answer and /evaluate_answer_batch ---
+def _validate_evaluation(question_data, student_answer):
+    # Returns an error message, or None if the submission can be evaluated
+    if not question_data or not student_answer:
+        return "Missing 'question_data' or 'student_answer' in request body."
+    # Ensure question_data has the expected keys and is a dictionary
+    if not isinstance(question_data, dict) or not all(k in question_data for k in ['answer', 'question', 'explanation']):
+        return "Invalid 'question_data' format. Required keys: 'answer', 'question', 'explanation'."
+    return None
+
+def _feedback_inputs(question_data, student_answer):
+    return {
+        "question_text": question_data['question'],
+        "student_answer": student_answer,
+        "correct_answer": question_data['answer'],
+        "is_correct": _check_answer(student_answer, question_data['answer']),
+        "explanation": question_data['explanation']
+    }
+
+async def _feedback_without_llm(inputs):
+    # Tries the templated fast path and then the semantic cache.
+    # Returns (feedback or None, embedding to store alongside the LLM's answer on a miss)
+    is_correct = inputs["is_correct"]
+    if is_correct and FAST_CORRECT_FEEDBACK:
+        logging.debug("Correct answer; returning templated feedback without calling the LLM.")
+        return {"is_correct": True, "feedback": f"Correct! {str(inputs['explanation'])[:400]}", "remediation_topic": ""}, None
+
+    if feedback_cache is None:
+        return None, None
+    try:
+        # Encoding is CPU-bound, so run it off the event loop
+        cache_vec = await asyncio.to_thread(
+            feedback_cache.embed, f"{inputs['question_text']}\n{inputs['student_answer']}\n{is_correct}")
+        cached = feedback_cache.lookup(cache_vec, str(inputs["student_answer"]).strip().lower(),
+                                       _answer_key(inputs["correct_answer"]), is_correct)
+    except Exception as e:
+        # The cache is only an optimization; treat any failure as a miss
+        logging.exception("Semantic feedback cache lookup failed: %s", e)
+        return None, None
+    if cached is not None:
+        logging.debug("Semantic cache hit for feedback generation.")
+    return cached, cache_vec
+
+def _remember_feedback(inputs, cache_vec, response):
+    if cache_vec is None:
+        return
+    try:
+        feedback_cache.add(cache_vec, str(inputs["student_answer"]).strip().lower(),
+                           _answer_key(inputs["correct_answer"]), inputs["is_correct"], response)
+    except Exception as e:
+        logging.exception("Could not add feedback to the semantic cache: %s", e)
 
 
 # --- 2. Answer Evaluation & Feedback Code (When Make.com sends an answer) ---
 @app.route('/evaluate_answer', methods=['POST'])
-def evaluate_answer():
+async def evaluate_answer():
     # --- START NEW DEBUGGING AND ROBUST PARSING LINES ---
     data = None # Initialize data to None
+    raw_data = b""
     try:
-        raw_data = request.get_data(as_text=True)
-        logging.debug(f"Received raw data for /evaluate_answer: {raw_data}")
-        logging.debug(f"Request Content-Type header: {request.headers.get('Content-Type')}")
-
-        # Attempt to parse JSON. Flask's request.json returns None if parsing fails
-        # or if Content-Type is not application/json
-        data = request.json
-        if data is None:
-            logging.error("request.json returned None. Raw data might be malformed JSON or Content-Type mismatch.")
-            return jsonify({
-                "error": "Could not parse JSON body. Ensure Content-Type is 'application/json' and body is valid JSON.",
-                "received_raw_data": raw_data
-            }), 400
+        # Read the body once, as bytes: orjson parses bytes directly, so there's no decode-to-str step
+        raw_data = await request.get_data(cache=False)
+        logging.debug("Received raw data for /evaluate_answer: %s", raw_data)
+        logging.debug("Request Content-Type header: %s", request.headers.get('Content-Type'))
+
+        data = orjson.loads(raw_data)
+    except orjson.JSONDecodeError as e:
+        logging.error("Could not parse JSON body for /evaluate_answer: %s", e)
+        return ojson({
+            "error": "Could not parse JSON body. Ensure Content-Type is 'application/json' and body is a valid JSON object.",
+            "received_raw_data": raw_data[:1024].decode('utf-8', 'replace')
+        }, 400)
     except Exception as e:
         # Catch any other unexpected errors during data reading
-        logging.error(f"Error reading request data for /evaluate_answer: {e}")
-        traceback.print_exc()
-        return jsonify({"error": f"Failed to read request data: {e}", "traceback": traceback.format_exc()}), 400
+        logging.exception("Error reading request data for /evaluate_answer: %s", e)
+        error_body = {"error": f"Failed to read request data: {e}"}
+        if DEBUG_ERRORS:
+            error_body["traceback"] = traceback.format_exc()
+        return ojson(error_body, 400)
+    if not isinstance(data, dict):
+        logging.error("JSON body for /evaluate_answer is not an object.")
+        return ojson({"error": "Request body must be a JSON object."}, 400)
     # --- END NEW DEBUGGING AND ROBUST PARSING LINES ---
 
     question_data = data.get('question_data')
     student_answer = data.get('student_answer')
 
-    if not question_data or not student_answer:
-        logging.warning("Missing 'question_data' or 'student_answer' in request body for evaluation.")
-        return jsonify({"error": "Missing 'question_data' or 'student_answer' in request body."}), 400
+    error = _validate_evaluation(question_data, student_answer)
+    if error:
+        logging.warning("Invalid /evaluate_answer request: %s", error)
+        return ojson({"error": error}, 400)
 
-    # Ensure question_data has the expected keys and is a dictionary
-    if not isinstance(question_data, dict) or not all(k in question_data for k in ['answer', 'question', 'explanation']):
-        logging.warning("Invalid 'question_data' format. Expected a dictionary with 'answer', 'question', 'explanation'.")
-        return jsonify({"error": "Invalid 'question_data' format. Required keys: 'answer', 'question', 'explanation'."}), 400
-
-    correct_answer = str(question_data['answer']).strip().lower()
-    question_text = question_data['question']
-    explanation = question_data['explanation']
-
-    is_correct = str(student_answer).strip().lower() == correct_answer
-
-    feedback_prompt = ChatPromptTemplate.from_messages([
-        ("system", f"""You are a supportive and insightful GMAT tutor.
-         Provide personalized feedback to the student based on their answer.
-         If correct, offer positive reinforcement and explain why it's right.
-         If incorrect, first clearly state the correct answer. Then, explain why the student's answer is wrong, why the correct answer is right (referencing the detailed explanation provided). Suggest a specific remediation topic (e.g., 'Algebra: Word Problems', 'Geometry: Triangles') if incorrect.
-         Keep feedback concise and encouraging.
-         Your output MUST be a JSON object conforming to the FeedbackOutput schema.
-         """),
-        ("human", f"""Student's question: {question_text}
-         Student's answer: {student_answer}
-         Correct answer: {correct_answer}
-         Is correct: {is_correct}
-         Detailed explanation: {explanation}
-         """)
-    ])
+    inputs = _feedback_inputs(question_data, student_answer)
+    feedback, cache_vec = await _feedback_without_llm(inputs)
+    if feedback is not None:
+        return ojson(feedback)
 
     try:
         logging.debug("Attempting to invoke LLM chain for feedback generation...")
-        chain = feedback_prompt | llm | JsonOutputParser(pydantic_object=FeedbackOutput)
-        response = chain.invoke({
-            "question_text": question_text,
-            "student_answer": student_answer,
-            "correct_answer": correct_answer,
-            "is_correct": is_correct,
-            "explanation": explanation
-        })
+        response = await FEEDBACK_CHAIN.ainvoke(inputs)
         logging.debug("LLM chain for feedback invoked successfully.")
-        return jsonify(response)
+        _remember_feedback(inputs, cache_vec, response)
+        return ojson(response)
     except Exception as e:
-        logging.error(f"ERROR during feedback generation: {e}")
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        logging.exception("ERROR during feedback generation: %s", e)
+        return ojson({"error": str(e)}, 500)
+
+
+# --- 2b. Batch Answer Evaluation (a whole class's answers in one request, fanned out to the LLM concurrently) ---
+FEEDBACK_BATCH_CONCURRENCY = 16
+FEEDBACK_BATCH_MAX_ITEMS = int(os.getenv("FEEDBACK_BATCH_MAX_ITEMS", "100"))
+
+@app.route('/evaluate_answer_batch', methods=['POST'])
+async def evaluate_answer_batch():
+    try:
+        data = orjson.loads(await request.get_data(cache=False))
+    except orjson.JSONDecodeError as e:
+        logging.error("Could not parse JSON body for /evaluate_answer_batch: %s", e)
+        return ojson({"error": "Could not parse JSON body. Ensure the body is valid JSON."}, 400)
+
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        logging.warning("Missing or empty 'items' list in request body for batch evaluation.")
+        return ojson({"error": "Request body must be a JSON object with a non-empty 'items' list."}, 400)
+    if len(items) > FEEDBACK_BATCH_MAX_ITEMS:
+        logging.warning("Rejected batch of %d items (max %d).", len(items), FEEDBACK_BATCH_MAX_ITEMS)
+        return ojson({"error": f"Too many items: at most {FEEDBACK_BATCH_MAX_ITEMS} per batch."}, 400)
+
+    # Results line up with items; a bad item gets an error entry instead of failing the whole batch
+    results = [None] * len(items)
+    valid = [] # (index, inputs) for items that passed validation
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {"error": "Each item must be an object with 'question_data' and 'student_answer'."}
+            continue
+        error = _validate_evaluation(item.get('question_data'), item.get('student_answer'))
+        if error:
+            results[i] = {"error": error}
+            continue
+        valid.append((i, _feedback_inputs(item['question_data'], item['student_answer'])))
+
+    # Run the fast path / semantic cache checks concurrently rather than one embedding at a time
+    prechecks = await asyncio.gather(*(_feedback_without_llm(inputs) for _, inputs in valid))
+    pending = [] # (index, inputs, cache_vec) for items that still need the LLM
+    for (i, inputs), (feedback, cache_vec) in zip(valid, prechecks):
+        if feedback is not None:
+            results[i] = feedback
+        else:
+            pending.append((i, inputs, cache_vec))
+
+    if pending:
+        logging.debug("Evaluating %d of %d batch items with the LLM...", len(pending), len(items))
+        responses = await FEEDBACK_CHAIN.abatch(
+            [inputs for _, inputs, _ in pending],
+            config={"max_concurrency": FEEDBACK_BATCH_CONCURRENCY},
+            return_exceptions=True
+        )
+        for (i, inputs, cache_vec), response in zip(pending, responses):
+            if isinstance(response, Exception):
+                logging.error("ERROR during batch feedback generation for item %d: %s", i, response, exc_info=response)
+                results[i] = {"error": str(response)}
+            else:
+                _remember_feedback(inputs, cache_vec, response)
+                results[i] = response
+
+    return ojson({"results": results})
 
 # --- TEST ROUTE FOR LLM CALL ---
 @app.route('/test_llm', methods=['POST'])
-def test_llm():
+async def test_llm():
     # --- START NEW DEBUGGING AND ROBUST PARSING LINES FOR TEST_LLM ---
     data = None
+    raw_data = b""
     try:
-        raw_data = request.get_data(as_text=True)
-        logging.debug(f"Received raw data for /test_llm: {raw_data}")
-        logging.debug(f"Request Content-Type header: {request.headers.get('Content-Type')}")
-
-        data = request.json
-        if data is None:
-            logging.error("request.json returned None for /test_llm. Raw data might be malformed JSON or content-type mismatch.")
-            return jsonify({
-                "status": "error",
-                "message": "Could not parse JSON body for /test_llm. Ensure Content-Type is 'application/json' and body is valid JSON.",
-                "received_raw_data": raw_data
-            }), 400
+        raw_data = await request.get_data(cache=False)
+        logging.debug("Received raw data for /test_llm: %s", raw_data)
+        logging.debug("Request Content-Type header: %s", request.headers.get('Content-Type'))
+
+        data = orjson.loads(raw_data)
+    except orjson.JSONDecodeError as e:
+        logging.error("Could not parse JSON body for /test_llm: %s", e)
+        return ojson({
+            "status": "error",
+            "message": "Could not parse JSON body for /test_llm. Ensure Content-Type is 'application/json' and body is a valid JSON object.",
+            "received_raw_data": raw_data[:1024].decode('utf-8', 'replace')
+        }, 400)
     except Exception as e:
-        logging.error(f"Error reading request data for /test_llm: {e}")
-        traceback.print_exc()
-        return jsonify({"status": "error", "message": f"Failed to read request data for /test_llm: {e}", "traceback": traceback.format_exc()}), 400
+        logging.exception("Error reading request data for /test_llm: %s", e)
+        error_body = {"status": "error", "message": f"Failed to read request data for /test_llm: {e}"}
+        if DEBUG_ERRORS:
+            error_body["traceback"] = traceback.format_exc()
+        return ojson(error_body, 400)
+    if not isinstance(data, dict):
+        logging.error("JSON body for /test_llm is not an object.")
+        return ojson({"status": "error", "message": "Request body for /test_llm must be a JSON object."}, 400)
     # --- END NEW DEBUGGING AND ROBUST PARSING LINES FOR TEST_LLM ---
 
     try:
         user_prompt = data.get('prompt', "Say 'Hello, AI is working!'")
-        logging.info(f"Test LLM route called with prompt: '{user_prompt}'")
-
-        test_prompt_template = ChatPromptTemplate.from_messages([
-            ("human", "{user_prompt}")
-        ])
+        logging.info("Test LLM route called with prompt: '%s'", user_prompt)
 
-        test_chain = test_prompt_template | llm
-        test_response = test_chain.invoke({"user_prompt": user_prompt})
-        logging.info(f"Test LLM invoke successful. Response: {test_response.content}")
-        return jsonify({"status": "success", "response": test_response.content})
+        test_response = await TEST_CHAIN.ainvoke({"user_prompt": user_prompt})
+        logging.info("Test LLM invoke successful. Response: %s", test_response.content)
+        return ojson({"status": "success", "response": test_response.content})
     except Exception as e:
-        logging.error(f"ERROR: Test LLM call failed: {e}")
-        traceback.print_exc()
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logging.exception("ERROR: Test LLM call failed: %s", e)
+        return ojson({"status": "error", "message": str(e)}, 500)
 # --- END TEST ROUTE ---
 
 
 # --- This starts the web connection (like turning on a listening phone) ---
+# Local development only; for production run: gunicorn -c gunicorn_conf.py app:app
 if __name__ == '__main__':
-    logging.info("Starting Flask server on http://127.0.0.1:5000/")
-    from werkzeug.serving import run_simple
-    run_simple('127.0.0.1', 5000, app, use_reloader=False, use_debugger=False)
\ No newline at end of file
+    logging.info("Starting Quart server on http://127.0.0.1:5000/")
+    app.run(host='127.0.0.1', port=5000, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,12 @@
+# --- Gunicorn settings for serving app.py in production ---
+# Run with: gunicorn -c gunicorn_conf.py app:app
+import os
+import multiprocessing
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# The app is ASGI (Quart), so each worker runs an asyncio loop that keeps many LLM calls in flight
+# instead of gthread's thread-per-request. Caches live per worker process.
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 75 # Keep Make.com/ngrok connections open between calls
+timeout = 120 # OpenRouter generations can take tens of seconds